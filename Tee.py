@@ -18,9 +18,14 @@ Prompt to GitHub Copilot to help:
 # NA
 
 # standard library imports
+import codecs
+import collections
 import io
 import os
+import re
 import sys
+import threading
+import traceback
 
 # See my answer: https://stackoverflow.com/a/74800814/4561887
 FULL_PATH_TO_SCRIPT = os.path.abspath(__file__)
@@ -57,11 +62,106 @@ def bytes_to_MiB(bytes):
 
 # Constants
 MAX_LOGFILE_SIZE_BYTES = MiB_to_bytes(25)
+# Size of the write buffer for each log file. Many small `print()` calls are coalesced into one
+# large write to disk per this many bytes.
+LOGFILE_BUFFER_SIZE_BYTES = MiB_to_bytes(1)
+# Default period at which a background thread flushes all log files to disk, like glog does
+FLUSH_INTERVAL_SEC = 30
+# Suggested text which, when printed, causes the log files to be flushed to disk right away. Pass
+# `flush_patterns=FLUSH_PATTERNS` to `Tee` to use it.
+FLUSH_PATTERNS = ("ERROR", "CRITICAL")
+# Max number of `write()` chunks of a single line to collect before checking them for flush patterns
+# anyway, such as for a progress bar which rewrites its line with `\r` and never prints a newline
+LINE_MAX_CHUNKS = 1000
+# Period at which the background writer thread wakes up on its own to write out everything queued
+# up by `write()`
+WRITE_INTERVAL_SEC = 0.1
+# Number of `write()` chunks waiting for the background writer thread at which `write()` wakes it
+# up early, rather than waiting for `WRITE_INTERVAL_SEC` to pass
+WRITE_QUEUE_WAKE_CHUNKS = 1000
+# Max number of `write()` chunks which may be waiting for the background writer thread before
+# `write()` blocks, to bound memory usage if the disk can't keep up with the program's output
+WRITE_QUEUE_MAX_CHUNKS = 100000
+# Max number of bytes to read from the stderr pipe at a time when `redirect_stderr_fd=True`
+STDERR_PIPE_READ_SIZE_BYTES = 64*1024
+
+
+def write_all_to_fd(fd, data):
+    """
+    Write all of these bytes to this file descriptor, carrying on after any partial writes.
+    """
+    data = memoryview(data)
+    while data:
+        num_bytes_written = os.write(fd, data)
+        data = data[num_bytes_written:]
+
+
+def get_non_tty_fd(file):
+    """
+    Get the file descriptor of this file object if it has one and it is **not** a terminal (ex:
+    stdout redirected to a file or a pipe), or None otherwise.
+    """
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError, ValueError):
+        # No real file descriptor, such as an `io.StringIO`, or pytest's captured stdout
+        return None
+
+    if os.isatty(fd):
+        return None
+    return fd
+
+
+def writes_plain_utf8(file):
+    """
+    Check whether this text file object writes text out as plain UTF-8, with no newline
+    translation, so that writing the UTF-8 encoding of some text straight to its file descriptor
+    gives the same bytes as passing that text to its `write()`.
+    - Its errors handler must leave all text which can be encoded alone; unlike
+      `"surrogateescape"`, for example.
+    - A `TextIOWrapper` doesn't tell what its newline translation is, but Python's own standard
+      streams only translate newlines on Windows, where `os.linesep` is `"\r\n"`.
+    """
+    encoding = getattr(file, "encoding", None)
+    if encoding is None:
+        return False
+
+    try:
+        if codecs.lookup(encoding).name != "utf-8":
+            return False
+    except LookupError:
+        return False
+
+    return getattr(file, "errors", None) in ("strict", "replace") and os.linesep == "\n"
+
+
+class _StderrToTee:
+    def __init__(self, tee):
+        """
+        Stand-in for `sys.stderr` while a `Tee` is redirecting stderr.
+        - Writes go through the `Tee` exactly as stdout writes do, but the `Tee` can also tell that
+          they came from stderr, and flush the log files after each complete line if
+          `flush_on_stderr=True`.
+        - Each write and its flush are done while holding the `Tee`'s write lock, since with
+          `redirect_stderr_fd=True`, they come from the background stderr thread.
+        """
+        self.tee = tee
+
+    def write(self, obj):
+        with self.tee._write_lock:
+            self.tee.write(obj)
+            if self.tee.flush_on_stderr and "\n" in obj:
+                self.tee.flush()
+
+    def flush(self):
+        self.tee.flush()
 
 
 class Tee:
     def __init__(self, *paths, append_lognum=True, immediately_flush=False, redirect_stderr=True,
-                 max_logfile_size_bytes=MAX_LOGFILE_SIZE_BYTES, _log_to_ram_only=False):
+                 max_logfile_size_bytes=MAX_LOGFILE_SIZE_BYTES, flush_interval_s=FLUSH_INTERVAL_SEC,
+                 background_writer=False, auto_rollover=False, flush_on_stderr=True,
+                 flush_patterns=(), redirect_stderr_fd=False, _log_to_ram_only=False):
         """
         Create a Tee object that writes to multiple files, as specified by the paths passed in.
         - This class mimics the behavior of the Unix `tee` command by writing all stdout output
@@ -71,7 +171,7 @@ class Tee:
         - paths: one or more paths to write to, as an `os.path` path object, or string.
         - append_lognum: if True, append a log number to the end of the file name, just before the
           extension, starting at 1, and incrementing by 1 each time a new file is created by
-          a manual call to `next_logfiles()`.
+          a manual call to `next_logfiles()`, or automatically if `auto_rollover=True`.
             So, if you use `append_lognum=True`, then the log file names as they increment will be
             like this:
             - `my_log_1.log`
@@ -82,27 +182,83 @@ class Tee:
             - `my_log_1.log`
             - `my_log_2.log`
         - immediately_flush: if True, flush the output to the file immediately after each write
+          - This is done by opening the log files unbuffered, so that each write goes straight
+            to the OS inside of Python's own C code, the same way that Python's built-in line
+            buffering works, rather than by calling `flush()` from Python after every write.
             CAUTION:
             - Setting `immediately_flush=True` can cause your flash memory to wear faster because of
               how often it has to rewrite the entire file to disk. It is recommended to leave this
               set to its default value of `False` unless you really need to see all data show up in
               the file immediately after each write.
             - If you leave `immediately_flush=False`, the file still auto-flushes every so often.
-              Testing shows it's about every 1m44sec or 8044 bytes written--I'm not sure which
-              triggers the auto-flush exactly, as I only tested it briefly to ensure it auto-flushed
-              at all, which it **does**.
-                - UPDATE 26 JAN 2025:
-                    1. It appears to be a **byte-triggered** line-buffered auto-flush, triggered
-                       every **~8 kB** written.
-                    2. Even with `immediately_flush=False`, no data is EVER lost so long as you
-                       properly close the file at the end of your program, because then any cached
-                       and unwritten data is flushed to disk at that time.
+              The auto-flush happens every time the log file's write buffer of
+              `LOGFILE_BUFFER_SIZE_BYTES` (1 MiB by default) fills up, **or** every
+              `flush_interval_s` seconds, whichever comes first.
+                - Even with `immediately_flush=False`, no data is EVER lost so long as you
+                  properly close the file at the end of your program, because then any cached
+                  and unwritten data is flushed to disk at that time.
         - redirect_stderr: if True, also redirect stderr to stdout and thereby logs stderr to the
           file(s); therefore, you'll be writing both stdout and stderr to the file(s) **and** to the
           console's **stdout**. If False, only stdout is written to the file(s), and stderr keeps
           the default behavior of being written to the console's stderr only.
         - max_logfile_size_bytes: the maximum size in bytes of each log file before a new log file
-          is created when `next_logfiles()` is called.
+          is created when `next_logfiles()` is called, or as soon as it is reached if
+          `auto_rollover=True`.
+        - flush_interval_s: the period, in seconds, at which a background thread flushes all log
+          files to disk when `immediately_flush=False`. This bounds how stale the log files on disk
+          can get when a program prints too slowly to fill up the write buffer. Set to `None` to
+          disable the periodic flush and only flush when the write buffer fills up.
+        - background_writer: if True, write to the log files from a background thread instead of
+          from the thread calling `print()`. `print()` then only writes to the console and appends
+          the text to a queue in memory. Every `WRITE_INTERVAL_SEC` seconds (0.1 s), or as soon as
+          `WRITE_QUEUE_WAKE_CHUNKS` writes have piled up, the background thread encodes all the
+          queued-up text at once and writes it to each log file in one go. The log files are
+          unbuffered in this mode, so `immediately_flush` and `flush_interval_s` have no effect.
+            - This only makes the program faster when there is a spare CPU core for the background
+              thread to run on, and the disk is slow. The background thread still needs the GIL to
+              do its work, so on a single CPU core, or with a fast disk, it usually makes `print()`
+              slower than the default synchronous writes do.
+            - `print()` only waits on the background thread when `WRITE_QUEUE_MAX_CHUNKS` writes
+              are already waiting, or when the log files are flushed, such as by `flush()`, by
+              `flush_on_stderr` or `flush_patterns`, or by `next_logfiles()`.
+            - If the background thread fails to write, such as when the disk is full, the
+              exception is raised by the next `write()`, `flush()`, or `end()`.
+            - If stdout is not a terminal, such as when running `./my_program.py > out.txt` or
+              `./my_program.py | less`, then there is no one watching the console to see output
+              right away, so the background thread writes the console's copy of the output too,
+              along with the log files. `print()` then does no I/O at all. This is only done when
+              stdout writes plain UTF-8 with no newline translation, so that the output is the
+              same either way (see `writes_plain_utf8()`).
+        - auto_rollover: if True, automatically roll over to the next log file, as though you had
+          called `next_logfiles()`, as soon as a write makes a log file reach
+          `max_logfile_size_bytes`. To know when that is without asking the OS, every write
+          counts its bytes, which adds a little to the cost of each `print()`. Unlike
+          `next_logfiles()`, this does not print the name of the new log file, since doing so
+          from inside `write()` would itself be a write.
+        - flush_on_stderr: if True, and `redirect_stderr=True`, flush the log files to disk after
+          every complete line written to stderr, even when `immediately_flush=False`. This way,
+          warnings, errors, and tracebacks make it to disk right away, even if the program then
+          crashes or hangs, while normal output still gets the full benefit of buffering.
+        - flush_patterns: a sequence of strings; whenever a complete line of output contains any
+          of them, flush the log files to disk right after that line, like `flush_on_stderr` does
+          for stderr. Ex: `flush_patterns=FLUSH_PATTERNS`, which is `("ERROR", "CRITICAL")`.
+          Defaults to `()`, which disables this check.
+            - The check is done once per line, rather than on every write, so a pattern is found
+              even when `print()` splits it across several writes, and the whole line is on disk
+              once it is found. It can still make each `print()` about half again as slow,
+              though, so only use it if you need it.
+        - redirect_stderr_fd: if True, and `redirect_stderr=True`, redirect stderr at the OS file
+          descriptor level instead of by replacing `sys.stderr`: file descriptor 2 is pointed at a
+          pipe, and a background thread reads from that pipe and writes what it reads to the
+          console's stdout and to the log files. This also catches stderr output which never goes
+          through `sys.stderr`, such as from C extensions and from child processes started with
+          `subprocess`. Since that thread writes to this Tee too, every `write()` then holds a lock,
+          and stderr is written to it one line at a time.
+            CAUTION:
+            - `end()` waits for the pipe to be closed by everything which holds it, so any child
+              processes which inherited stderr must have exited first.
+            - Call `end()` in a `finally` block, so that a traceback from an uncaught exception
+              is still written to the real stderr.
         - _log_to_ram_only: log to RAM only instead of to files as data is printed to stdout.
           Not intended to be used by users directly; instead, use the `TeeToRam` subclass.
         """
@@ -112,7 +268,68 @@ class Tee:
         self.immediately_flush = immediately_flush
         self.redirect_stderr = redirect_stderr
         self.max_logfile_size_bytes = max_logfile_size_bytes
+        self.flush_interval_s = flush_interval_s
+        self.background_writer = background_writer
+        self.auto_rollover = auto_rollover
+        self.flush_on_stderr = flush_on_stderr
+        self.flush_patterns = flush_patterns
+        self.redirect_stderr_fd = redirect_stderr_fd
         self.log_to_ram_only = _log_to_ram_only
+        # Size of the RAM buffer's ring buffer when logging to RAM, or None for no limit. Set by
+        # `TeeToRam`.
+        self.max_ram_bytes = None
+
+        # A single compiled regex finds any of the flush patterns with one search of the text
+        self._flush_patterns_regex = None
+        if flush_patterns:
+            self._flush_patterns_regex = re.compile(
+                "|".join(re.escape(pattern) for pattern in flush_patterns))
+        # Chunks passed to `write()` since the end of the last line, to check for flush patterns
+        # once the line is complete
+        self._line_chunks = []
+        # Whether `write()` needs to call `_check_line_and_rollover()` at all
+        self._check_lines_or_rollover = bool(flush_patterns) or auto_rollover
+
+        # Protects `self.logfiles` from being swapped out or closed by the main thread while the
+        # background writer thread is using them
+        self._logfiles_lock = threading.Lock()
+        # Always held around rolling over to the next log files and around `flush()`, so that the
+        # periodic flush thread never flushes a log file that is being closed. Also held around
+        # every `write()` while the background stderr thread of `redirect_stderr_fd=True` is
+        # writing to this Tee too. It's reentrant, since `next_logfiles()` prints while holding it.
+        self._write_lock = threading.RLock()
+        # The version of `write()` which `_write_with_lock()` calls while holding the write lock
+        self._write_unlocked = None
+        self._flush_thread = None
+        self._stop_flush_thread = threading.Event()
+        self._writer_thread = None
+        self._write_queue = None
+        # Used by the main thread to wait for the background writer thread to write out everything
+        # queued up so far. The writer thread counts the chunks it takes off of the queue, and the
+        # chunks it is done writing, and notifies waiters after each batch.
+        self._writer_done_cond = threading.Condition()
+        self._writer_wakeup = threading.Event()
+        self._stop_writer_thread = False
+        self._num_chunks_taken = 0
+        self._num_chunks_written = 0
+        # Exception hit by the background writer thread, to be raised in the main thread
+        self._writer_error = None
+        # `write()` calls `_on_write_queue_backlog()` once the queue holds this many chunks. The
+        # writer thread sets it to 0 when it hits an exception, so that the very next `write()`
+        # raises it, with no extra check in `write()` itself.
+        self._write_queue_wake_len = WRITE_QUEUE_WAKE_CHUNKS
+        self._stderr_thread = None
+        # Bound `write()` methods of the original stdout and of all the log files, and the log
+        # files' descriptors, cached so that the hot paths don't have to look them up every time
+        self._stdout_write = None
+        self._logfile_writes = ()
+        self._logfile_fds = ()
+        # File descriptor of the original stdout when the background writer thread writes to it
+        # too, or None
+        self._stdout_fd = None
+        # Set for real by `_open_logfiles()`; until then, nothing is counted towards a rollover
+        self._num_bytes_written = 0
+        self._next_rollover_at = float("inf")
 
     def _get_numbered_path(self, path_original, logfile_number):
         """
@@ -123,6 +340,34 @@ class Tee:
         new_path = f"{root}_{logfile_number}{ext}"
         return new_path
 
+    def _open_logfile(self, path):
+        """
+        Open a single log file for writing.
+        - By default, the file is opened in text mode with a `LOGFILE_BUFFER_SIZE_BYTES` write
+          buffer, so that `write()` hands each string straight to the file's `TextIOWrapper`, which
+          encodes it to UTF-8 and buffers it in C. That's faster than encoding it in Python and
+          writing the bytes to a binary file. The `BufferedWriter` underneath has a lock, which
+          keeps the periodic flush thread's flushes from interleaving with the main thread's
+          writes.
+        - With `immediately_flush=True`, the text layer sits directly on top of the unbuffered raw
+          file, with `write_through=True`, so that every write goes straight to the OS with no need
+          to flush it afterwards.
+        - When using the background writer thread, or when writing the RAM buffer of a `TeeToRam`
+          to disk, the file is opened unbuffered in binary mode instead, since the data is already
+          UTF-8 bytes, batched up into large writes. That's the raw `FileIO` layer only.
+        - Newlines are never translated, so the log files always get exactly the bytes counted by
+          `write()`, no matter the OS.
+        - Either way, `open()` creates the descriptor with `O_CLOEXEC` set, so child processes don't
+          inherit it.
+        """
+        if self.background_writer or self.log_to_ram_only:
+            return open(path, "wb", buffering=0)
+        if self.immediately_flush:
+            return io.TextIOWrapper(open(path, "wb", buffering=0), encoding="utf-8",
+                                    errors="replace", newline="", write_through=True)
+        return open(path, "w", encoding="utf-8", errors="replace", newline="",
+                    buffering=LOGFILE_BUFFER_SIZE_BYTES)
+
     def _open_logfiles(self):
         """
         Open all log files for writing.
@@ -134,37 +379,392 @@ class Tee:
         # list of the current log numbers for each log file
         self.logfile_numbers = [STARTING_LOGNUMBER - 1]*len(self.PATHS)
 
+        # With `auto_rollover=True`, track the size of each log file without asking the OS, since
+        # it's needed after every write: every log file receives the same bytes, so count the total
+        # bytes written to the log files, and record what that count was when each log file was
+        # opened. The size of log file `i` is then the difference.
+        self._num_bytes_written = 0
+        self._logfile_start_offsets = [0]*len(self.PATHS)
+        self._update_next_rollover_at()
+
+        # Create each distinct parent directory only once, since log files usually share one.
+        # Rolled-over log files go in the same directories, so they never need to create any.
+        # - Skip an empty dirname, meaning the current directory, as `os.makedirs("")` raises.
+        parent_dirs = {os.path.dirname(path) for path in self.PATHS}
+        for parent_dir in parent_dirs:
+            if parent_dir:
+                os.makedirs(parent_dir, exist_ok=True)
+
         # Open all the files for writing
         for i, path in enumerate(self.PATHS):
             if self.append_lognum:
                 path = self._get_numbered_path(path, STARTING_LOGNUMBER)
                 self.logfile_numbers[i] = STARTING_LOGNUMBER
 
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-
-            logfile = open(path, "w", encoding="utf-8")
+            logfile = self._open_logfile(path)
             self.logfiles[i] = logfile
 
+        self._cache_logfile_handles()
         print(f"Opened log files at: {self.get_logfile_names()}")
 
+    def _cache_logfile_handles(self):
+        """
+        Cache the bound `write()` methods of all the currently-open log files, and their file
+        descriptors, as tuples, for use in the hot paths of `write()` and of the background writer
+        thread. Call this every time `self.logfiles` changes.
+        """
+        self._logfile_writes = tuple(f.write for f in self.logfiles)
+        self._logfile_fds = tuple(f.fileno() for f in self.logfiles)
+
+    def _get_logfile_size_bytes(self, i):
+        """
+        Get the number of bytes written so far to log file `i`.
+        - With `auto_rollover=True`, `write()` counts the bytes anyway, so this needs no system
+          call.
+        - Otherwise, flush the log file and ask the OS. That's one system call per log file per call
+          to `next_logfiles()`, rather than counting bytes on every `write()`, which would slow down
+          every `print()` to save a system call that is rarely needed. When using the background
+          writer thread, `next_logfiles()` has already waited for it, and the log files are
+          unbuffered, so the size is exact too.
+        """
+        if self.auto_rollover:
+            return self._num_bytes_written - self._logfile_start_offsets[i]
+
+        logfile = self.logfiles[i]
+        logfile.flush()
+        return os.fstat(logfile.fileno()).st_size
+
+    def _update_next_rollover_at(self):
+        """
+        Update `self._next_rollover_at`: the value of `self._num_bytes_written` at which the
+        fullest log file reaches `self.max_logfile_size_bytes`, or infinity if `auto_rollover` is
+        off. This way, `write()` only needs a single comparison to know when to roll over.
+        """
+        if not self.auto_rollover:
+            self._next_rollover_at = float("inf")
+            return
+
+        self._next_rollover_at = min(self._logfile_start_offsets) + self.max_logfile_size_bytes
+
+    def _roll_over_logfile(self, i):
+        """
+        Close log file `i` and open a new one in its place with the next log number.
+        Returns the path to the new log file.
+        """
+        self.logfile_numbers[i] += 1
+        new_path = self._get_numbered_path(self.PATHS[i], self.logfile_numbers[i])
+        with self._write_lock, self._logfiles_lock:
+            self.logfiles[i].close()
+            self.logfiles[i] = self._open_logfile(new_path)
+            self._cache_logfile_handles()
+        self._logfile_start_offsets[i] = self._num_bytes_written
+        self._update_next_rollover_at()
+        return new_path
+
+    def _auto_roll_over_logfiles(self):
+        """
+        Roll over every log file which has reached `self.max_logfile_size_bytes`. Called by
+        `write()` when `auto_rollover=True`.
+        """
+        if self._writer_thread is not None:
+            # Wait for the background writer thread to finish writing to the current log files
+            self._wait_for_writer_thread()
+
+        for i in range(len(self.logfiles)):
+            if self._get_logfile_size_bytes(i) >= self.max_logfile_size_bytes:
+                self._roll_over_logfile(i)
+
     def begin(self):
         """
         Begin tee-ing stdout to the console and to one or more log files if `self.log_to_ram_only`
         is False, or to a RAM buffer only otherwise.
         """
+        # Set up the RAM buffer or the background writer's queue before `write()` can be called.
+        # The log files themselves are only opened once stdout is being tee-d, so that the message
+        # saying they were opened gets logged too, but before stderr is redirected, so that if
+        # opening them fails, the traceback still goes straight to the real stderr.
+        if self.log_to_ram_only:
+            self._init_ram_buffer()
+        elif self.background_writer:
+            self._start_writer_thread()
+
         # Save the original stdout, and replace it with the Tee object
         self.stdout_bak = sys.stdout
+        self._stdout_write = self.stdout_bak.write
+        if self.background_writer and writes_plain_utf8(self.stdout_bak):
+            self._stdout_fd = get_non_tty_fd(self.stdout_bak)
+            if self._stdout_fd is not None:
+                # The background writer thread will write straight to this descriptor from now on,
+                # so first write out anything still buffered in the stdout object, to keep it all in
+                # order
+                self.stdout_bak.flush()
+        self.write = self._get_specialized_write()
+        if self.redirect_stderr and self.redirect_stderr_fd:
+            self._write_unlocked = self.write
+            self.write = self._write_with_lock
         sys.stdout = self
 
-        if self.redirect_stderr:
-            # Save the original stderr, and replace it with the Tee object
-            self.stderr_bak = sys.stderr
-            sys.stderr = self
+        try:
+            if not self.log_to_ram_only:
+                self._open_logfiles()
+
+            if self.redirect_stderr and self.redirect_stderr_fd:
+                self._start_stderr_pipe()
+            elif self.redirect_stderr:
+                # Save the original stderr, and replace it with a stand-in that writes to the Tee
+                # object
+                self.stderr_bak = sys.stderr
+                sys.stderr = _StderrToTee(self)
+
+            if not self.log_to_ram_only and not self.background_writer \
+                    and not self.immediately_flush and self.flush_interval_s is not None:
+                self._start_flush_thread()
+        except BaseException:
+            self._undo_begin()
+            raise
+
+    def _undo_begin(self):
+        """
+        Undo everything `begin()` did before it failed, so that stdout and stderr work normally
+        again, and the exception's traceback goes to the real stderr.
+        """
+        self._stop_stderr_pipe_and_join()
+        if isinstance(sys.stderr, _StderrToTee) and sys.stderr.tee is self:
+            sys.stderr = self.stderr_bak
 
-        if not self.log_to_ram_only:
-            self._open_logfiles()
-        else:
-            self.stringio_buffer = io.StringIO()
+        self._stop_flush_thread_and_join()
+        self._stop_writer_thread_and_join()
+        # Already reported by the exception being raised, or about to be, by `begin()`
+        self._writer_error = None
+
+        # Close whichever log files were opened
+        for f in getattr(self, "logfiles", ()):
+            if f is not None:
+                f.close()
+
+        sys.stdout = self.stdout_bak
+        vars(self).pop("write", None)
+
+    def _start_stderr_pipe(self):
+        """
+        Redirect file descriptor 2 (stderr) to a new pipe, and start the background thread which
+        forwards everything written to it to this Tee.
+        """
+        sys.stderr.flush()
+        # Keep a copy of the original stderr file descriptor, to restore it in `end()`
+        self._stderr_fd_bak = os.dup(2)
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, 2)
+        # Now only file descriptor 2 (and copies of it inherited by child processes) holds the
+        # write end open, so the reader sees end-of-file once `end()` restores file descriptor 2
+        os.close(write_fd)
+
+        self._stderr_thread = threading.Thread(
+            target=self._forward_stderr_pipe, args=(read_fd,), daemon=True)
+        self._stderr_thread.start()
+
+    def _forward_stderr_pipe(self, read_fd):
+        """
+        Background stderr thread target: read everything written to stderr from the read end of the
+        pipe, and write it to this Tee just like `sys.stderr` writes are when
+        `redirect_stderr_fd=False`. Exits at end-of-file, once the write end has been closed.
+        - If writing to this Tee raises an exception, such as when the disk is full, the text and
+          the traceback are written to the original stderr instead, and this thread carries on.
+          It must never stop reading from the pipe, or else everything writing to stderr would
+          block forever once the pipe fills up.
+        """
+        stderr_to_tee = _StderrToTee(self)
+        # Decodes UTF-8 even when a multi-byte character is split across two reads
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        while True:
+            data = os.read(read_fd, STDERR_PIPE_READ_SIZE_BYTES)
+            text = decoder.decode(data, final=not data)
+            # Write one line at a time, as `sys.stderr` writes usually are, so that with
+            # `auto_rollover=True`, one big read from the pipe can't overfill a log file
+            for line in text.splitlines(keepends=True):
+                try:
+                    stderr_to_tee.write(line)
+                except Exception:
+                    message = f"{traceback.format_exc()}{line}"
+                    try:
+                        write_all_to_fd(self._stderr_fd_bak,
+                                        message.encode("utf-8", errors="replace"))
+                    except OSError:
+                        pass
+            if not data:
+                break
+
+        os.close(read_fd)
+
+    def _stop_stderr_pipe_and_join(self):
+        """
+        Point file descriptor 2 back at the original stderr, and wait for the background stderr
+        thread to forward whatever was still in the pipe and exit.
+        """
+        if self._stderr_thread is None:
+            return
+
+        sys.stderr.flush()
+        os.dup2(self._stderr_fd_bak, 2)
+        self._stderr_thread.join()
+        self._stderr_thread = None
+        # Only close it now, since the background stderr thread falls back to writing to it
+        os.close(self._stderr_fd_bak)
+
+    def _start_writer_thread(self):
+        """
+        Start the background thread which writes all data queued up by `write()` to the log files.
+        """
+        # A `deque`'s `append()` and `popleft()` are thread-safe and never block, so `write()` only
+        # has to append to it, with no locks or notifications. The writer thread wakes up on its own
+        # every `WRITE_INTERVAL_SEC` seconds instead, or sooner when `write()` or the main thread
+        # wakes it up.
+        self._write_queue = collections.deque()
+        self._writer_wakeup.clear()
+        self._stop_writer_thread = False
+        self._writer_error = None
+        self._write_queue_wake_len = WRITE_QUEUE_WAKE_CHUNKS
+        self._writer_thread = threading.Thread(target=self._drain_write_queue, daemon=True)
+        self._writer_thread.start()
+
+    def _drain_write_queue(self):
+        """
+        Background writer thread target: every `WRITE_INTERVAL_SEC` seconds, or sooner when woken
+        up, take everything queued up by `write()`, encode it all to UTF-8 at once, and write it to
+        each log file, and to stdout too if `self._stdout_fd` is set, with one `os.write()` each.
+        - Any exception from writing is stored, to be raised in the main thread by its next call
+          to `write()`, `flush()`, or `end()`, and this thread carries on, so that nothing ever
+          waits forever on it.
+        - Exits once `end()` has asked it to stop and it has written everything queued up before
+          that.
+        """
+        write_queue = self._write_queue
+        while True:
+            self._writer_wakeup.wait(WRITE_INTERVAL_SEC)
+            self._writer_wakeup.clear()
+            # Read this before taking the batch, since everything written before `end()` asked this
+            # thread to stop is already in the queue by then
+            stopping = self._stop_writer_thread
+
+            with self._writer_done_cond:
+                num_chunks = len(write_queue)
+                batch = [write_queue.popleft() for _ in range(num_chunks)]
+                self._num_chunks_taken += num_chunks
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                self._writer_error = e
+                self._write_queue_wake_len = 0
+            finally:
+                with self._writer_done_cond:
+                    self._num_chunks_written += num_chunks
+                    self._writer_done_cond.notify_all()
+
+            if stopping:
+                return
+
+    def _write_batch(self, batch):
+        """
+        Write this batch of strings taken off of the write queue to stdout if `self._stdout_fd` is
+        set, and to all the log files.
+        """
+        data = "".join(batch).encode("utf-8", errors="replace")
+
+        if self._stdout_fd is not None:
+            try:
+                write_all_to_fd(self._stdout_fd, data)
+            except BrokenPipeError:
+                # Whatever was reading our stdout, such as `head`, has exited; keep logging to the
+                # files anyway
+                self._stdout_fd = None
+
+        with self._logfiles_lock:
+            for fd in self._logfile_fds:
+                write_all_to_fd(fd, data)
+
+    def _wait_for_writer_thread(self):
+        """
+        Wake up the background writer thread, and wait for it to write out everything queued up so
+        far. Then raise any exception it hit while doing so.
+        """
+        with self._writer_done_cond:
+            num_chunks_to_write = self._num_chunks_taken + len(self._write_queue)
+            self._writer_wakeup.set()
+            self._writer_done_cond.wait_for(
+                lambda: self._num_chunks_written >= num_chunks_to_write)
+
+        self._raise_writer_error()
+
+    def _raise_writer_error(self):
+        """
+        If the background writer thread hit an exception since the last call, raise it here.
+        """
+        error = self._writer_error
+        if error is None:
+            return
+
+        self._writer_error = None
+        self._write_queue_wake_len = WRITE_QUEUE_WAKE_CHUNKS
+        raise error
+
+    def _on_write_queue_backlog(self):
+        """
+        Called by `write()` once `self._write_queue_wake_len` chunks are waiting in the write queue:
+        raise any exception hit by the background writer thread, and wake it up, or wait for it if
+        the queue is full.
+        """
+        self._raise_writer_error()
+
+        if len(self._write_queue) >= WRITE_QUEUE_MAX_CHUNKS:
+            self._wait_for_writer_thread()
+        elif not self._writer_wakeup.is_set():
+            self._writer_wakeup.set()
+
+    def _stop_writer_thread_and_join(self):
+        """
+        Let the background writer thread, if running, write out everything still queued up, then
+        wait for it to exit. Any exception it hit is left for `end()` to raise.
+        """
+        if self._writer_thread is None:
+            return
+
+        self._stop_writer_thread = True
+        self._writer_wakeup.set()
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._write_queue = None
+        self._stdout_fd = None
+
+    def _start_flush_thread(self):
+        """
+        Start the background thread which flushes all log files every `self.flush_interval_s`
+        seconds.
+        """
+        self._stop_flush_thread.clear()
+        self._flush_thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flush_thread.start()
+
+    def _flush_periodically(self):
+        """
+        Background thread target: flush all log files every `self.flush_interval_s` seconds until
+        `self._stop_flush_thread` is set.
+        """
+        while not self._stop_flush_thread.wait(self.flush_interval_s):
+            self.flush()
+
+    def _stop_flush_thread_and_join(self):
+        """
+        Stop the background flush thread, if running, and wait for it to exit.
+        """
+        if self._flush_thread is None:
+            return
+
+        self._stop_flush_thread.set()
+        self._flush_thread.join()
+        self._flush_thread = None
 
     def next_logfiles(self, force_file_rollover=False):
         """
@@ -179,19 +779,22 @@ class Tee:
                 "Error: log files have not been opened yet. Call `begin()` first if not "
                 "logging to RAM, or `write_ram_to_logfiles()` if you were logging to RAM.")
 
-        for i, f in enumerate(self.logfiles):
-            # See: https://stackoverflow.com/a/283719/4561887
-            file_size_bytes = f.tell()
+        if self._writer_thread is not None:
+            # Wait for the background writer thread to catch up, so that everything printed before
+            # this call ends up in the current log files, and so that their sizes are up-to-date
+            self._wait_for_writer_thread()
 
-            if file_size_bytes >= self.max_logfile_size_bytes or force_file_rollover:
-                f.close()
+        # Hold the write lock, so that the background stderr thread can't write to the log files
+        # while they are being swapped out
+        with self._write_lock:
+            for i in range(len(self.logfiles)):
+                file_size_bytes = self._get_logfile_size_bytes(i)
 
-                # Open a new file with the next log number
-                self.logfile_numbers[i] += 1
-                new_path = self._get_numbered_path(self.PATHS[i], self.logfile_numbers[i])
-                self.logfiles[i] = open(new_path, "w", encoding="utf-8")
-                # Note: this print **will** be logged to all log files as well.
-                print(f"Opened new log file at: {new_path}")
+                if file_size_bytes >= self.max_logfile_size_bytes or force_file_rollover:
+                    # Open a new file with the next log number
+                    new_path = self._roll_over_logfile(i)
+                    # Note: this print **will** be logged to all log files as well.
+                    print(f"Opened new log file at: {new_path}")
 
     def get_logfile_names(self):
         """
@@ -209,35 +812,206 @@ class Tee:
         End tee-ing stdout to the console and to one or more log files or to RAM.
         - NB: do NOT close the RAM buffer, or else you cannot read from it later!
         """
-        if not self.log_to_ram_only:
-            # Close all the files
-            for f in self.logfiles:
-                f.close()
+        # Stop forwarding stderr first, so that everything written to it is still logged
+        self._stop_stderr_pipe_and_join()
 
-        # Restore sys.stdout
-        sys.stdout = self.stdout_bak
+        try:
+            if not self.log_to_ram_only:
+                self._stop_writer_thread_and_join()
+                self._stop_flush_thread_and_join()
 
-        if self.redirect_stderr:
-            # Restore sys.stderr
-            sys.stderr = self.stderr_bak
+                # Close all the files
+                for f in self.logfiles:
+                    f.close()
+        finally:
+            # Restore stdout and stderr even if closing a log file failed, such as when flushing
+            # it to a full disk, so that the exception's traceback can be seen.
+            sys.stdout = self.stdout_bak
+
+            if self.redirect_stderr and not self.redirect_stderr_fd:
+                # Restore sys.stderr
+                sys.stderr = self.stderr_bak
+
+            # Undo the specialization of `write()` done by `begin()`
+            vars(self).pop("write", None)
+
+        # Now that everything is closed and restored, raise any exception the background writer
+        # thread hit while writing out the last of the data
+        self._raise_writer_error()
 
     def write(self, obj):
         """
         Write to the original stdout and to all log files or to RAM.
         - NB: if `self.redirect_stderr` is True, then this will also write/redirect stderr to the
           console's stdout.
+        - The log files are opened in text mode by default, so `obj` is handed to them as-is. The
+          background writer thread and the RAM buffer work with bytes instead, so for those, `obj`
+          is encoded to UTF-8 only once here, rather than once per log file, or once more at the
+          end to write the RAM buffer to disk.
+        - Anything which can't be encoded to UTF-8, such as a lone surrogate character from a
+          badly-decoded file name, is logged as `?` instead of raising an exception in the middle
+          of a `print()`.
+        - None of the settings which decide where the data goes can change between `begin()` and
+          `end()`, so `begin()` replaces this method, on this object only, with whichever one of
+          the `_write_to_*()` methods below matches them. That way, each `print()` runs straight
+          through the one version of `write()` it needs, with no checks of where the data goes on
+          every call.
         """
+        self._get_specialized_write()(obj)
 
-        self.stdout_bak.write(obj)
+    def _get_specialized_write(self):
+        """
+        Get the version of `write()` to use for the current settings.
+        """
+        if self.log_to_ram_only:
+            return self._write_to_console_and_ram
+        if self.background_writer:
+            if self._stdout_fd is not None:
+                return self._write_to_queue
+            return self._write_to_console_and_queue
+        return self._write_to_console_and_logfiles
+
+    def _write_with_lock(self, obj):
+        """
+        `write()` for `redirect_stderr_fd=True`: the background stderr thread writes to this Tee
+        too, so call the version of `write()` for the rest of the settings while holding the write
+        lock. That keeps the two threads from interleaving their writes, from racing to update
+        the byte counter, and from writing to log files being rolled over.
+        """
+        with self._write_lock:
+            self._write_unlocked(obj)
 
-        if not self.log_to_ram_only:
-            # Write to all the log files
-            for f in self.logfiles:
-                f.write(obj)
-                if self.immediately_flush:
-                    f.flush() # Ensure the output is written immediately
+    def _write_to_console_and_logfiles(self, obj):
+        """
+        `write()` for the default settings: write to the console and to all the log files.
+        - With `immediately_flush=True`, the log files are unbuffered, so this writes straight
+          through to the OS.
+        """
+        self._stdout_write(obj)
+
+        # Write to all the log files
+        for logfile_write in self._logfile_writes:
+            logfile_write(obj)
+
+        if self._check_lines_or_rollover:
+            self._check_line_and_rollover(obj)
+
+    def _write_to_console_and_queue(self, obj):
+        """
+        `write()` for `background_writer=True`: write to the console, and queue the data up for
+        the background writer thread to encode and write to all the log files.
+        """
+        self._stdout_write(obj)
+
+        write_queue = self._write_queue
+        write_queue.append(obj)
+        if len(write_queue) >= self._write_queue_wake_len:
+            self._on_write_queue_backlog()
+
+        if self._check_lines_or_rollover:
+            self._check_line_and_rollover(obj)
+
+    def _write_to_queue(self, obj):
+        """
+        `write()` for `background_writer=True` when stdout is not a terminal and writes plain UTF-8:
+        queue the data up for the background writer thread to encode and write to all the log files
+        **and** to the console.
+        """
+        write_queue = self._write_queue
+        write_queue.append(obj)
+        if len(write_queue) >= self._write_queue_wake_len:
+            self._on_write_queue_backlog()
+
+        if self._check_lines_or_rollover:
+            self._check_line_and_rollover(obj)
+
+    def _check_line_and_rollover(self, obj):
+        """
+        The end of every `write()` to the log files when `flush_patterns` or `auto_rollover` is set:
+        once this write completes a line, flush the log files if that line contains any of the
+        flush patterns, then roll over to the next log files if the current ones are full.
+        """
+        if self._flush_patterns_regex is not None:
+            line_chunks = self._line_chunks
+            line_chunks.append(obj)
+            if "\n" in obj or len(line_chunks) >= LINE_MAX_CHUNKS:
+                text = "".join(line_chunks)
+                line_chunks.clear()
+                # Keep any partial line after the last newline for the next check
+                i_line_end = text.rfind("\n") + 1
+                if 0 < i_line_end < len(text):
+                    line_chunks.append(text[i_line_end:])
+                    text = text[:i_line_end]
+                if self._flush_patterns_regex.search(text):
+                    self.flush()
+
+        if self.auto_rollover:
+            # Pure ASCII text is one byte per character, so the UTF-8 encoding is only needed to
+            # count the bytes of any other text
+            self._num_bytes_written += (
+                len(obj) if obj.isascii() else len(obj.encode("utf-8", errors="replace")))
+            if self._num_bytes_written >= self._next_rollover_at:
+                self._auto_roll_over_logfiles()
+
+    def _write_to_console_and_ram(self, obj):
+        """
+        `write()` for `TeeToRam`: write to the console and to the RAM buffer.
+        """
+        self._stdout_write(obj)
+
+        obj_bytes = obj.encode("utf-8", errors="replace")
+        if obj_bytes:
+            self._write_to_ram(obj_bytes)
+
+    def _init_ram_buffer(self):
+        """
+        Create a new, empty RAM buffer.
+        """
+        self.ram_buffer_size_bytes = 0
+
+        if self.max_ram_bytes is None:
+            # list of the UTF-8-encoded chunks passed to `write()`, in order
+            self.ram_buffer_chunks = []
+        else:
+            self.ram_ring_buffer = bytearray(self.max_ram_bytes)
+            # index in the ring buffer at which the next byte will be written; once the ring
+            # buffer is full, this is also the index of the oldest byte
+            self.ram_ring_buffer_head = 0
+
+    def _write_to_ram(self, obj_bytes):
+        """
+        Store these UTF-8-encoded bytes in the RAM buffer.
+        """
+        if self.max_ram_bytes is None:
+            self.ram_buffer_chunks.append(obj_bytes)
+            self.ram_buffer_size_bytes += len(obj_bytes)
+            return
+
+        # Copy the bytes into the ring buffer with at most two slice assignments, wrapping around
+        # to the start of it as needed, and overwriting the oldest bytes once it is full
+        ring = self.ram_ring_buffer
+        capacity = len(ring)
+        num_bytes = len(obj_bytes)
+
+        if num_bytes >= capacity:
+            # Only the last `capacity` bytes will fit
+            ring[:] = memoryview(obj_bytes)[num_bytes - capacity:]
+            self.ram_ring_buffer_head = 0
+            self.ram_buffer_size_bytes = capacity
+            return
+
+        head = self.ram_ring_buffer_head
+        i_end = head + num_bytes
+        if i_end <= capacity:
+            ring[head:i_end] = obj_bytes
         else:
-            self.stringio_buffer.write(obj)
+            num_bytes_before_wrap = capacity - head
+            obj_bytes_view = memoryview(obj_bytes)
+            ring[head:] = obj_bytes_view[:num_bytes_before_wrap]
+            ring[:num_bytes - num_bytes_before_wrap] = obj_bytes_view[num_bytes_before_wrap:]
+
+        self.ram_ring_buffer_head = i_end % capacity
+        self.ram_buffer_size_bytes = min(self.ram_buffer_size_bytes + num_bytes, capacity)
 
     def flush(self):
         """
@@ -246,16 +1020,27 @@ class Tee:
         Exception ignored in: <__main__.Tee object at 0x7fbeb88cfb20>
         AttributeError: 'Tee' object has no attribute 'flush'
         ```
+        - When using the background writer thread, the log files are unbuffered, so this waits for
+          that thread to write out everything queued up so far instead, and raises any exception
+          it hit.
         """
-        if not self.log_to_ram_only:
-            # Flush all the log files
+        if self.log_to_ram_only:
+            return
+
+        if self._writer_thread is not None:
+            self._wait_for_writer_thread()
+            return
+
+        # Flush all the log files, while holding the write lock so that no other thread can roll
+        # any of them over in the meantime
+        with self._write_lock:
             for f in self.logfiles:
                 f.flush()
 
 
 class TeeToRam(Tee):
     def __init__(self, append_lognum=True, redirect_stderr=True,
-                 max_logfile_size_bytes=MAX_LOGFILE_SIZE_BYTES):
+                 max_logfile_size_bytes=MAX_LOGFILE_SIZE_BYTES, max_ram_bytes=None):
         """
         Similar to the `Tee` class, but instead of writing to disk as data is printed to stdout,
         it writes to RAM instead, and only writes the log to disk at the end, if desired and
@@ -272,28 +1057,62 @@ class TeeToRam(Tee):
         - redirect_stderr: same as in `Tee` class.
         - max_logfile_size_bytes: same as in `Tee` class; files will be split by this size when
           written to the disk at the end.
+        - max_ram_bytes: if not None, the RAM buffer becomes a fixed-size ring buffer of this many
+          bytes, allocated once at `begin()`. Once it is full, each new write overwrites the oldest
+          data, so only the **last** `max_ram_bytes` bytes of output are kept. Use this for
+          long-running programs, where an unbounded RAM buffer would eventually use up all of RAM.
+          If None, the RAM buffer grows without limit, keeping all output.
         """
 
         super().__init__(None, append_lognum=append_lognum,
                          immediately_flush=False,
                          redirect_stderr=redirect_stderr,
                          max_logfile_size_bytes=max_logfile_size_bytes,
+                         flush_interval_s=None,
                          _log_to_ram_only=True)
 
+        self.max_ram_bytes = max_ram_bytes
+
+    def _get_ram_buffer_chunks(self):
+        """
+        Get the contents of the RAM buffer as a list of bytes-like chunks, oldest first, without
+        copying them.
+        """
+        if self.max_ram_bytes is None:
+            return self.ram_buffer_chunks
+
+        ring_view = memoryview(self.ram_ring_buffer)
+        head = self.ram_ring_buffer_head
+        if self.ram_buffer_size_bytes < len(self.ram_ring_buffer):
+            # Not full yet, so it hasn't wrapped around
+            return [ring_view[:head]]
+
+        # Full: the oldest bytes start at `head`. Since they were overwritten from the front, skip
+        # any leading UTF-8 continuation bytes (`0b10xxxxxx`) of a partially-overwritten character.
+        oldest_chunks = [ring_view[head:], ring_view[:head]]
+        for i_chunk, chunk in enumerate(oldest_chunks):
+            i_start = 0
+            while i_start < len(chunk) and chunk[i_start] & 0xC0 == 0x80:
+                i_start += 1
+            oldest_chunks[i_chunk] = chunk[i_start:]
+            if i_start < len(chunk):
+                break
+        return [chunk for chunk in oldest_chunks if chunk]
+
     def get_ram_buffer_str(self):
         """
         Get the current RAM string buffer.
+        - The RAM buffer is stored as UTF-8 bytes, so this decodes a full copy of it. Only call this
+          when you actually need the string.
         """
-        return self.stringio_buffer.getvalue()
+        return b''.join(self._get_ram_buffer_chunks()).decode("utf-8")
 
     def get_ram_buffer_used_size_bytes(self):
         """
         Get the current RAM string buffer used size in bytes.
         Uses UTF-8 encoding to match file writing behavior.
         """
-        ram_buffer_str = self.get_ram_buffer_str()
-        ram_buffer_size_bytes = len(ram_buffer_str.encode('utf-8'))
-        return ram_buffer_size_bytes
+        return self.ram_buffer_size_bytes
 
     def write_ram_to_logfiles(self, *paths):
         """
@@ -301,57 +1120,92 @@ class TeeToRam(Tee):
         - Write in chunks and roll over to new log files as required if the RAM buffer is larger
           than or equal to `self.max_logfile_size_bytes`.
         - When rolling over to a new file, break on newlines to ensure complete lines only.
+        - This streams through the RAM buffer in order, so each log file is opened, written
+          sequentially from start to end, and closed exactly once, and all log files are closed
+          even if an error occurs part way through.
         """
         self.PATHS = paths
         self._open_logfiles()
-        ram_buffer_str = self.get_ram_buffer_str()
 
-        # Now write the RAM buffer to the log files in chunks, rolling over to new files as needed,
-        # breaking on newlines once the file exceeds `self.max_logfile_size_bytes`.
-
-        total_chars_written = 0
-        # slicing indices
-        I_SLICE_MAX = len(ram_buffer_str)  # the index to stop at to obtain the full ram buffer str
-        i_slice_end = 0
+        try:
+            self._write_ram_buffer_to_open_logfiles()
+        finally:
+            # Close all log files, even if writing to them failed part way through
+            for f in self.logfiles:
+                f.close()
 
-        # Write the RAM buffer to the log files in chunks <= `self.max_logfile_size_bytes`
-        while total_chars_written < len(ram_buffer_str):
+    def _write_ram_buffer_to_open_logfiles(self):
+        """
+        Write the whole RAM buffer to the log files opened by `write_ram_to_logfiles()`.
+        """
+        # Now write the RAM buffer to the log files one window of up to
+        # `self.max_logfile_size_bytes` at a time, rolling over to new files as needed, and breaking
+        # on newlines once the file exceeds `self.max_logfile_size_bytes`. Only one window is held
+        # in memory at a time, rather than a second full copy of the whole RAM buffer.
+
+        ram_buffer_chunks = self._get_ram_buffer_chunks()
+        if self.max_ram_bytes is not None:
+            # Copy the ring buffer first, since if tee-ing to RAM is still active, the "Opened new
+            # log file" messages printed below get written into it, and would overwrite the oldest
+            # bytes before they are written out. Its size is bounded by `self.max_ram_bytes`.
+            # The chunks of the unbounded RAM buffer are immutable `bytes`, so they need no copy.
+            ram_buffer_chunks = [bytes(chunk) for chunk in ram_buffer_chunks]
+
+        # chunks not yet copied into the window; memoryviews let us split them without copying
+        pending_chunks = collections.deque(memoryview(chunk) for chunk in ram_buffer_chunks)
+        window = bytearray()
+
+        while window or pending_chunks:
             force_file_rollover = False
 
-            # Update slicing indices for the next chunk
-            i_slice_start = i_slice_end
-            i_slice_end = min(i_slice_start + self.max_logfile_size_bytes, I_SLICE_MAX)
+            # Fill up the window with the next `self.max_logfile_size_bytes` bytes, at most
+            while pending_chunks and len(window) < self.max_logfile_size_bytes:
+                chunk = pending_chunks.popleft()
+                num_bytes_free = self.max_logfile_size_bytes - len(window)
+                if len(chunk) > num_bytes_free:
+                    # Save the rest of this chunk for the next window
+                    pending_chunks.appendleft(chunk[num_bytes_free:])
+                    chunk = chunk[:num_bytes_free]
+                window += chunk
 
-            if i_slice_end < I_SLICE_MAX:
+            i_window_end = len(window)
+
+            if pending_chunks:
                 # We need to roll over to a new file, so let's first scan backwards for the last
-                # newline character in this slice, and end the file there to get complete lines
+                # newline character in this window, and end the file there to get complete lines
                 # only before rolling over to a new file.
-
-                # Move `i_slice_end` backwards to the last newline character
-                last_newline_index = ram_buffer_str.rfind('\n', i_slice_start, i_slice_end)
+                last_newline_index = window.rfind(b'\n')
                 if last_newline_index != -1:
                     # a newline char was found
-                    i_slice_end = last_newline_index + 1  # include the newline character
+                    i_window_end = last_newline_index + 1  # include the newline character
+                    force_file_rollover = True
+                else:
+                    # No newline char was found, so end the file at the end of the window, but
+                    # without splitting a multi-byte UTF-8 character across two files. UTF-8
+                    # continuation bytes are all of the form `0b10xxxxxx`.
+                    next_byte = pending_chunks[0][0]
+                    while i_window_end > 0 and next_byte & 0xC0 == 0x80:
+                        i_window_end -= 1
+                        next_byte = window[i_window_end]
+                    if i_window_end == 0:
+                        # Not valid UTF-8 anyway; just split it at the end of the window
+                        i_window_end = len(window)
                     force_file_rollover = True
 
-            chars_written_expected = i_slice_end - i_slice_start
-            # Write the chunk to all log files
+            bytes_written_expected = i_window_end
+            # Write the window to all log files
             for f in self.logfiles:
-                chars_written_actual = f.write(ram_buffer_str[i_slice_start:i_slice_end])
+                bytes_written_actual = f.write(window[:i_window_end])
                 # Sanity check:
-                assert chars_written_actual == chars_written_expected, \
-                    f"Error: wrote {chars_written_actual} chars, expected to write " \
-                    f"{chars_written_expected} chars"
+                assert bytes_written_actual == bytes_written_expected, \
+                    f"Error: wrote {bytes_written_actual} bytes, expected to write " \
+                    f"{bytes_written_expected} bytes"
 
-            total_chars_written += chars_written_expected
+            del window[:i_window_end]
 
             # Auto-roll over the log files
             self.next_logfiles(force_file_rollover)
 
-        # Close all log files
-        for f in self.logfiles:
-            f.close()
-
 
 def demo_log_to_file():
     """